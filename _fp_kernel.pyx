@@ -0,0 +1,56 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True, language_level=3
+"""
+Ahead-of-time compiled target-zone pair search.
+
+This is the same two-pass algorithm as the Numba kernel in app.py, built
+as a C extension so a fresh worker pays no JIT warmup at all. Build with:
+
+    python setup.py build_ext --inplace
+
+app.py imports it opportunistically and falls back to Numba/NumPy when
+the extension hasn't been built.
+"""
+import numpy as np
+
+cimport numpy as cnp
+
+cnp.import_array()
+
+
+def find_pairs(double[::1] times, double[::1] freqs,
+               double t_start, double t_dur, double f_width):
+    """Returns (anchor_idx, target_idx) int64 arrays for the target zone."""
+    cdef Py_ssize_t n = times.shape[0]
+    cdef Py_ssize_t i, j, k
+    cdef Py_ssize_t total = 0
+    cdef double t_min, t_max, df
+
+    for i in range(n):
+        t_min = times[i] + t_start
+        t_max = t_min + t_dur
+        for j in range(i + 1, n):
+            if times[j] > t_max:
+                break
+            df = freqs[j] - freqs[i]
+            if times[j] >= t_min and -f_width <= df <= f_width:
+                total += 1
+
+    anchor_idx = np.empty(total, dtype=np.int64)
+    target_idx = np.empty(total, dtype=np.int64)
+    cdef long long[::1] a = anchor_idx
+    cdef long long[::1] t = target_idx
+
+    k = 0
+    for i in range(n):
+        t_min = times[i] + t_start
+        t_max = t_min + t_dur
+        for j in range(i + 1, n):
+            if times[j] > t_max:
+                break
+            df = freqs[j] - freqs[i]
+            if times[j] >= t_min and -f_width <= df <= f_width:
+                a[k] = i
+                t[k] = j
+                k += 1
+
+    return anchor_idx, target_idx
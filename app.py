@@ -1,112 +1,482 @@
+import concurrent.futures
+import functools
+import io
 import os
 import numpy as np
 import librosa
-from scipy.ndimage import maximum_filter
-from flask import Flask, request, jsonify
-from werkzeug.utils import secure_filename
+import orjson
+import soundfile as sf
+from scipy.ndimage import maximum_filter1d
+from flask import Flask, request
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+try:
+    import torch
+    import torchaudio
+except ImportError:
+    torch = None
+
+try:
+    import pyfftw
+    import scipy.fft
+    # Route scipy.fft (and therefore librosa.stft) through FFTW's planned,
+    # SIMD-tuned kernels. The interface cache keeps plans alive between
+    # requests; single-threaded because the gunicorn workers and the
+    # fingerprinting pool already provide the parallelism.
+    pyfftw.interfaces.cache.enable()
+    pyfftw.interfaces.cache.set_keepalive_time(60)
+    pyfftw.config.NUM_THREADS = 1
+    scipy.fft.set_global_backend(pyfftw.interfaces.scipy_fft)
+except ImportError:
+    pyfftw = None
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+try:
+    import _fp_kernel  # built via `python setup.py build_ext --inplace`
+except ImportError:
+    _fp_kernel = None
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = 'uploads/'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB max upload size
 
-# Create the 'uploads' folder if it doesn't exist
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
-    os.makedirs(app.config['UPLOAD_FOLDER'])
+# STFT configuration. SR matches librosa.load's default resample rate;
+# N_FFT and HOP_LENGTH are librosa.stft's defaults, spelled out so the
+# cached frequency table and the closed-form frame times below stay in
+# lockstep with the transform.
+SR = 22050
+N_FFT = 2048
+HOP_LENGTH = N_FFT // 4
+
+if pyfftw is not None:
+    # Plan the transform size once at import so the first request doesn't
+    # pay FFTW's planner cost.
+    librosa.stft(np.zeros(N_FFT, dtype=np.float32), n_fft=N_FFT, hop_length=HOP_LENGTH)
+
+# Quantization steps for hash packing: frequencies to 10 Hz bins, time
+# deltas to 10 ms bins. Coarse enough to absorb STFT jitter, fine enough
+# to keep hash collisions rare.
+FREQ_BIN_HZ = 10.0
+TIME_BIN_S = 0.01
+
+# Lazily-built torchaudio Spectrogram transform, kept resident on the GPU.
+_GPU_SPECTROGRAM = None
+
+
+def _spectrogram_db(y):
+    """
+    Computes the dB-scaled spectrogram of a waveform.
+
+    Uses torchaudio on the GPU when torch is installed and CUDA is
+    available — the STFT is the dominant compute cost and runs an order of
+    magnitude faster there — and falls back to librosa on the CPU
+    otherwise. Both paths match librosa's amplitude_to_db(ref=np.max)
+    scaling, so downstream thresholds are unaffected.
+    """
+    if torch is not None and torch.cuda.is_available():
+        global _GPU_SPECTROGRAM
+        if _GPU_SPECTROGRAM is None:
+            _GPU_SPECTROGRAM = torchaudio.transforms.Spectrogram(
+                n_fft=N_FFT, hop_length=HOP_LENGTH, pad_mode='constant', power=2.0).to('cuda')
+        S = _GPU_SPECTROGRAM(torch.from_numpy(y).to('cuda', non_blocking=True))
+        ref = torch.clamp(S.max(), min=1e-10)
+        S_db = torchaudio.functional.amplitude_to_DB(
+            S, multiplier=10.0, amin=1e-10,
+            db_multiplier=torch.log10(ref).item(), top_db=80.0)
+        return S_db.cpu().numpy()
+
+    D = librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH)
+    return librosa.amplitude_to_db(np.abs(D), ref=np.max)
+
+
+@functools.lru_cache(maxsize=None)
+def _fft_frequencies(sr, n_fft):
+    """Caches the STFT frequency axis, which is fixed for a given (sr, n_fft)."""
+    return librosa.fft_frequencies(sr=sr, n_fft=n_fft)
+
+
+# Peak detection parameters: a peak is a local maximum within a
+# NEIGHBORHOOD_SIZE x NEIGHBORHOOD_SIZE window that is louder than
+# AMPLITUDE_THRESHOLD dB (relative to the loudest bin).
+NEIGHBORHOOD_SIZE = 15
+AMPLITUDE_THRESHOLD = -50.0
+
+# Frames per block for the streaming CPU path (~47 s of audio at the
+# default hop). Caps the resident spectrogram at a few tens of MB
+# regardless of upload length.
+STREAM_BLOCK_FRAMES = 2048
+
+# Peak thinning: keep only the strongest peaks per log-frequency band and
+# time window, and pair each anchor with at most MAX_FAN_OUT targets.
+# Dense spectrograms otherwise produce quadratically many near-duplicate
+# hashes with no recall benefit (Shazam uses a small fan-out constant for
+# the same reason).
+PEAK_BANDS = 30
+PEAK_WINDOW_S = 1.0
+PEAKS_PER_BAND = 5
+MAX_FAN_OUT = 5
+
+
+def _peak_mask(S_db):
+    """Returns the boolean peak mask for a dB spectrogram (or block of one)."""
+    # Keep everything float32: the filter and comparisons are memory-bound,
+    # so a float64 promotion anywhere upstream would double the bandwidth.
+    if S_db.dtype != np.float32:
+        S_db = S_db.astype(np.float32, copy=False)
+    local_max = np.empty_like(S_db)
+    maximum_filter1d(S_db, size=NEIGHBORHOOD_SIZE, axis=0, mode='constant', cval=-np.inf, output=local_max)
+    maximum_filter1d(local_max, size=NEIGHBORHOOD_SIZE, axis=1, mode='constant', cval=-np.inf, output=local_max)
+    if numexpr is not None:
+        # numexpr evaluates the fused expression over cache-sized tiles, so
+        # S_db and local_max stream through memory once instead of three
+        # times.
+        return numexpr.evaluate(
+            '(S_db == local_max) & (S_db > thresh)',
+            local_dict={'S_db': S_db, 'local_max': local_max,
+                        'thresh': np.float32(AMPLITUDE_THRESHOLD)})
+    # Preallocated boolean buffers; the combine reuses the first one, so no
+    # spectrogram-sized temporary is allocated per expression.
+    mask = np.empty(S_db.shape, dtype=bool)
+    above = np.empty(S_db.shape, dtype=bool)
+    np.equal(S_db, local_max, out=mask)
+    np.greater(S_db, np.float32(AMPLITUDE_THRESHOLD), out=above)
+    np.logical_and(mask, above, out=mask)
+    return mask
+
+
+def _stream_peaks(y, n_fft=N_FFT, hop_length=HOP_LENGTH):
+    """
+    Detects spectrogram peaks without materializing the full STFT.
+
+    A long upload's complex STFT plus its magnitude/dB/filter copies can
+    run to hundreds of MB. This computes the STFT in blocks of
+    STREAM_BLOCK_FRAMES frames over the center-padded signal: a first
+    scan finds the global magnitude reference, a second converts each
+    block to dB and runs peak detection with a half-neighborhood halo of
+    extra frames so peaks at block seams match the monolithic result
+    exactly. Returns (freq_bin_indices, frame_indices, peak_dB_values).
+    """
+    # Same constant (zero) center padding librosa.stft applies by default.
+    y_padded = np.pad(y, n_fft // 2)
+    n_frames = 1 + (len(y_padded) - n_fft) // hop_length
+
+    def _stft_block(f0, f1):
+        segment = y_padded[f0 * hop_length:(f1 - 1) * hop_length + n_fft]
+        return librosa.stft(segment, n_fft=n_fft, hop_length=hop_length, center=False)
+
+    # Pass 1: global reference magnitude for the dB scale.
+    ref = 0.0
+    for f0 in range(0, n_frames, STREAM_BLOCK_FRAMES):
+        f1 = min(f0 + STREAM_BLOCK_FRAMES, n_frames)
+        ref = max(ref, np.abs(_stft_block(f0, f1)).max())
+
+    # Pass 2: per-block dB conversion and peak detection. The halo gives
+    # the max filter full context for every interior frame.
+    halo = NEIGHBORHOOD_SIZE // 2
+    amin = 1e-5  # librosa.amplitude_to_db default
+    ref_db = 20.0 * np.log10(max(amin, ref))
+    peak_rows, peak_cols, peak_vals = [], [], []
+    for f0 in range(0, n_frames, STREAM_BLOCK_FRAMES):
+        f1 = min(f0 + STREAM_BLOCK_FRAMES, n_frames)
+        b0 = max(0, f0 - halo)
+        b1 = min(n_frames, f1 + halo)
+        S = np.abs(_stft_block(b0, b1))
+        S_db = 20.0 * np.log10(np.maximum(amin, S)) - ref_db
+        np.maximum(S_db, -80.0, out=S_db)  # librosa's top_db clamp
+        mask = _peak_mask(S_db)
+        interior = S_db[:, f0 - b0:f0 - b0 + (f1 - f0)]
+        rows, cols = np.nonzero(mask[:, f0 - b0:f0 - b0 + (f1 - f0)])
+        peak_rows.append(rows)
+        peak_cols.append(cols + f0)
+        peak_vals.append(interior[rows, cols])
+
+    rows = np.concatenate(peak_rows)
+    cols = np.concatenate(peak_cols)
+    vals = np.concatenate(peak_vals)
+    # Restore np.nonzero's row-major order so downstream behavior matches
+    # the monolithic path exactly.
+    order = np.lexsort((cols, rows))
+    return rows[order], cols[order], vals[order]
+
+
+def _group_ranks(keys):
+    """Ranks elements within runs of equal values in a sorted key array."""
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    counts = np.diff(np.concatenate((starts, [len(keys)])))
+    return np.arange(len(keys)) - np.repeat(starts, counts)
+
+
+def _thin_peaks(rows, cols, amps):
+    """
+    Keeps the PEAKS_PER_BAND strongest peaks per (log-frequency band,
+    time window), so hash count grows linearly with song length instead
+    of quadratically with peak density.
+    """
+    freqs = _fft_frequencies(SR, N_FFT)[rows]
+    f_low = SR / N_FFT  # first non-zero STFT bin
+    f_high = SR / 2.0
+    band = np.log(np.maximum(freqs, f_low) / f_low)
+    band = np.minimum((PEAK_BANDS * band / np.log(f_high / f_low)).astype(np.int64),
+                      PEAK_BANDS - 1)
+    window = (cols * HOP_LENGTH) // int(PEAK_WINDOW_S * SR)
+    group = band * (int(window.max()) + 1) + window
+
+    # Sort by group with the loudest peaks first, rank within each group,
+    # and keep the top K — all without a Python loop.
+    order = np.lexsort((-amps, group))
+    keep = order[_group_ranks(group[order]) < PEAKS_PER_BAND]
+    keep.sort()  # restore row-major peak order
+    return rows[keep], cols[keep]
+
+
+def _cap_fan_out(anchor_idx, target_idx):
+    """Keeps at most MAX_FAN_OUT targets (the earliest) per anchor."""
+    keep = _group_ranks(anchor_idx) < MAX_FAN_OUT
+    return anchor_idx[keep], target_idx[keep]
+
+
+# Target zone for pairing an anchor peak with later peaks.
+TARGET_ZONE_START_TIME = 0.1
+TARGET_ZONE_TIME_DURATION = 0.8
+TARGET_ZONE_FREQ_WIDTH = 200.0
+
+
+def _find_pairs_numpy(times, freqs):
+    """
+    Finds (anchor, target) peak index pairs inside the target zone.
+
+    For each anchor, the candidate targets form a contiguous slice of the
+    time-sorted peaks, found with two binary searches; the resulting index
+    ranges are expanded and masked by frequency band entirely in NumPy.
+    """
+    n = len(times)
+    lo = np.searchsorted(times, times + TARGET_ZONE_START_TIME, side='left')
+    hi = np.searchsorted(times, times + TARGET_ZONE_START_TIME + TARGET_ZONE_TIME_DURATION, side='right')
+
+    counts = hi - lo
+    anchor_idx = np.repeat(np.arange(n), counts)
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    target_idx = np.repeat(lo, counts) + (np.arange(counts.sum()) - np.repeat(offsets, counts))
+
+    in_band = np.abs(freqs[target_idx] - freqs[anchor_idx]) <= TARGET_ZONE_FREQ_WIDTH
+    return anchor_idx[in_band], target_idx[in_band]
+
+
+if _fp_kernel is not None:
+    # Ahead-of-time compiled extension: no JIT warmup in fresh workers.
+    def _find_pairs(times, freqs):
+        return _fp_kernel.find_pairs(np.ascontiguousarray(times), np.ascontiguousarray(freqs),
+                                     TARGET_ZONE_START_TIME, TARGET_ZONE_TIME_DURATION,
+                                     TARGET_ZONE_FREQ_WIDTH)
+elif numba is not None:
+    @numba.njit(cache=True, fastmath=True)
+    def _find_pairs_kernel(times, freqs, t_start, t_dur, f_width):
+        # Two passes: count the surviving pairs first, then fill exact-size
+        # output arrays. Unlike the vectorized expansion, this never
+        # materializes the unmasked candidate pairs, so memory stays bounded
+        # even when peaks are dense.
+        n = times.shape[0]
+        total = 0
+        for i in range(n):
+            t_min = times[i] + t_start
+            t_max = t_min + t_dur
+            for j in range(i + 1, n):
+                if times[j] > t_max:
+                    break
+                if times[j] >= t_min and abs(freqs[j] - freqs[i]) <= f_width:
+                    total += 1
+        anchor_idx = np.empty(total, dtype=np.int64)
+        target_idx = np.empty(total, dtype=np.int64)
+        k = 0
+        for i in range(n):
+            t_min = times[i] + t_start
+            t_max = t_min + t_dur
+            for j in range(i + 1, n):
+                if times[j] > t_max:
+                    break
+                if times[j] >= t_min and abs(freqs[j] - freqs[i]) <= f_width:
+                    anchor_idx[k] = i
+                    target_idx[k] = j
+                    k += 1
+        return anchor_idx, target_idx
+
+    def _find_pairs(times, freqs):
+        return _find_pairs_kernel(times, freqs, TARGET_ZONE_START_TIME,
+                                  TARGET_ZONE_TIME_DURATION, TARGET_ZONE_FREQ_WIDTH)
+
+    # Warm up the JIT at import so the first request doesn't pay compile cost.
+    _find_pairs(np.array([0.0, 0.5], dtype=np.float64), np.array([100.0, 200.0], dtype=np.float64))
+else:
+    _find_pairs = _find_pairs_numpy
+
+
+def _pack_hashes(anchor_freqs, target_freqs, time_deltas):
+    """
+    Packs quantized (f1, f2, dt) triples into stable uint64 hash keys.
+
+    Unlike Python's randomized hash(), the packed keys are identical across
+    processes and runs, and the whole computation is vectorized. A final
+    multiply-xor mix (MurmurHash3 finalizer) spreads the packed bits so the
+    keys also index well into hash tables.
+    """
+    f1q = (anchor_freqs / FREQ_BIN_HZ).astype(np.uint64)
+    f2q = (target_freqs / FREQ_BIN_HZ).astype(np.uint64)
+    dtq = (time_deltas / TIME_BIN_S).astype(np.uint64)
+    h = (f1q << np.uint64(40)) | (f2q << np.uint64(20)) | dtq
+    h ^= h >> np.uint64(33)
+    h *= np.uint64(0xff51afd7ed558ccd)
+    h ^= h >> np.uint64(33)
+    h *= np.uint64(0xc4ceb9fe1a85ec53)
+    h ^= h >> np.uint64(33)
+    return h
+
+
+def _decode_audio(data):
+    """
+    Decodes raw audio bytes to a mono float32 waveform at SR.
+
+    Reads straight from memory via soundfile, so uploads never touch disk.
+    """
+    y, sr = sf.read(io.BytesIO(data), dtype='float32')
+    if y.ndim > 1:
+        y = y.mean(axis=1)
+    if sr != SR:
+        y = librosa.resample(y, orig_sr=sr, target_sr=SR)
+    return y
+
 
 # --- Core Audio Fingerprinting Logic (Your Function) ---
-def fingerprint_song(file_path):
+def fingerprint_song(y):
     """
-    Generates a landmark-based fingerprint for a single audio file.
-    
+    Generates a landmark-based fingerprint for a decoded waveform.
+
     Args:
-        file_path (str): Path to the audio file.
-        
+        y (np.ndarray): Mono float32 waveform sampled at SR.
+
     Returns:
         dict: A dictionary of {hash: timestamp}
     """
     try:
-        y, sr = librosa.load(file_path)
-
-        # 1. Create Spectrogram
-        D = librosa.stft(y)
-        S_db = librosa.amplitude_to_db(np.abs(D), ref=np.max)
-
-        # 2. Find Peaks
-        neighborhood_size = 15
-        local_max = maximum_filter(S_db, footprint=np.ones((neighborhood_size, neighborhood_size)), mode='constant')
-        detected_peaks = (S_db == local_max)
-        amplitude_threshold = -50.0
-        peaks = np.where((detected_peaks) & (S_db > amplitude_threshold))
-        
-        if not peaks[0].any():
+        # 1+2. Spectrogram and peaks. With a GPU the full spectrogram is
+        # cheap to hold; on the CPU, stream it in blocks to cap memory.
+        if torch is not None and torch.cuda.is_available():
+            S_db = _spectrogram_db(y)
+            rows, cols = np.nonzero(_peak_mask(S_db))
+            amps = S_db[rows, cols]
+        else:
+            rows, cols, amps = _stream_peaks(y)
+
+        if not rows.any():
             return {}
 
+        rows, cols = _thin_peaks(rows, cols, amps)
+
         # 3. Structure Peaks
-        n_fft = (D.shape[0] - 1) * 2
-        peak_freqs_at_peaks = librosa.fft_frequencies(sr=sr, n_fft=n_fft)[peaks[0]]
-        peak_times = librosa.frames_to_time(frames=peaks[1], sr=sr, n_fft=n_fft)
-        peaks_list = list(zip(peak_times, peak_freqs_at_peaks))
-        sorted_peaks = sorted(peaks_list, key=lambda p: p[0])
+        peak_freqs_at_peaks = _fft_frequencies(SR, N_FFT)[rows]
+        # Closed form of librosa.frames_to_time: frame * hop plus the
+        # n_fft // 2 centering offset, converted to seconds.
+        peak_times = cols * (HOP_LENGTH / SR) + (N_FFT // 2) / SR
 
         # 4. Create Hashes
-        song_fingerprint = {}
-        TARGET_ZONE_START_TIME = 0.1
-        TARGET_ZONE_TIME_DURATION = 0.8
-        TARGET_ZONE_FREQ_WIDTH = 200
-
-        for i, anchor_peak in enumerate(sorted_peaks):
-            anchor_time, anchor_freq = anchor_peak
-            t_min = anchor_time + TARGET_ZONE_START_TIME
-            t_max = t_min + TARGET_ZONE_TIME_DURATION
-            f_min = anchor_freq - TARGET_ZONE_FREQ_WIDTH
-            f_max = anchor_freq + TARGET_ZONE_FREQ_WIDTH
-            
-            for j in range(i + 1, len(sorted_peaks)):
-                target_peak = sorted_peaks[j]
-                target_time, target_freq = target_peak
-                if target_time > t_max:
-                    break
-                if t_min <= target_time <= t_max and f_min <= target_freq <= f_max:
-                    time_delta = target_time - anchor_time
-                    h = hash((anchor_freq, target_freq, time_delta))
-                    song_fingerprint[h] = anchor_time
-                    
+        # Keep the peaks as two parallel arrays sorted by time — a compiled
+        # C sort, and the layout the pair kernels index directly.
+        order = np.argsort(peak_times, kind='stable')
+        times = peak_times[order]
+        freqs = peak_freqs_at_peaks[order]
+
+        anchor_idx, target_idx = _cap_fan_out(*_find_pairs(times, freqs))
+
+        anchor_times = times[anchor_idx]
+        time_deltas = times[target_idx] - anchor_times
+        anchor_freqs = freqs[anchor_idx]
+        target_freqs = freqs[target_idx]
+
+        hashes = _pack_hashes(anchor_freqs, target_freqs, time_deltas)
+        song_fingerprint = dict(zip(hashes.tolist(), anchor_times.tolist()))
+
         return song_fingerprint
 
     except Exception as e:
-        print(f"Could not process {file_path}. Error: {e}")
+        print(f"Could not process audio. Error: {e}")
+        return {}
+
+
+def _fingerprint_upload(data):
+    """Decodes and fingerprints a raw upload; runs in a pool worker."""
+    try:
+        y = _decode_audio(data)
+    except Exception as e:
+        print(f"Could not decode upload. Error: {e}")
         return {}
+    return fingerprint_song(y)
+
+def _json_response(obj, status=200):
+    """
+    Serializes a response with orjson instead of Flask's stdlib jsonify.
+
+    orjson encodes in C (3-10x faster on the 100k-key fingerprint dicts this
+    endpoint returns) and handles the integer hash keys and NumPy scalars
+    directly.
+    """
+    body = orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return app.response_class(body, status=status, mimetype='application/json')
+
+
+# Process pool for fingerprinting. Worker processes sidestep the GIL for
+# the Python-level parts of the pipeline and let librosa's FFT/BLAS work
+# run on separate cores; each worker warms its caches (and the Numba JIT)
+# on import. Created lazily so spawned children don't recurse.
+_POOL = None
+
+
+def _worker_pool():
+    global _POOL
+    if _POOL is None:
+        _POOL = concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count())
+    return _POOL
+
 
 # --- API Endpoint ---
 @app.route('/fingerprint', methods=['POST'])
 def generate_fingerprint_endpoint():
     """API endpoint to receive a song and return its fingerprint."""
     if 'file' not in request.files:
-        return jsonify({"error": "No file part in the request"}), 400
-    
+        return _json_response({"error": "No file part in the request"}, status=400)
+
     file = request.files['file']
 
     if file.filename == '':
-        return jsonify({"error": "No selected file"}), 400
+        return _json_response({"error": "No selected file"}, status=400)
 
     if file:
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-
-        fingerprint_data = fingerprint_song(file_path)
-        
-        os.remove(file_path)
+        fingerprint_data = _worker_pool().submit(_fingerprint_upload, file.read()).result()
 
         if not fingerprint_data:
-            return jsonify({
+            return _json_response({
                 "message": "Could not generate fingerprint. The audio might be silent or too short.",
                 "fingerprint": {}
-            }), 200
+            })
 
-        return jsonify(fingerprint_data)
+        return _json_response(fingerprint_data)
 
 # --- Main Execution ---
+# In production run under gunicorn so requests aren't serialized behind
+# Werkzeug's single-threaded debug server:
+#
+#     gunicorn -w $(nproc) -k sync --timeout 60 app:app
+#
+# Each worker keeps its own warm caches (FFT frequency table, Numba
+# kernels) and its own fingerprinting process pool.
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    # Local development only; the debugger/reloader is opt-in via FLASK_DEBUG.
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', port=5000)
@@ -0,0 +1,18 @@
+"""Builds the optional compiled fingerprint kernel.
+
+Usage:
+
+    python setup.py build_ext --inplace
+
+The app runs without it; building just removes the Numba JIT warmup and
+its first-call latency from fresh workers.
+"""
+import numpy as np
+from Cython.Build import cythonize
+from setuptools import setup
+
+setup(
+    name='fp-kernel',
+    ext_modules=cythonize('_fp_kernel.pyx'),
+    include_dirs=[np.get_include()],
+)